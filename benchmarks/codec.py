@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""Microbenchmarks of the codec hot path: TsvRpc, column encodings, assoc helpers and serializers.
+
+Runs offline. Each case reports ops/sec and the peak memory allocated by a single call, and the
+results can be compared against a stored baseline:
+
+    python -m benchmarks.codec --baseline benchmarks/codec_baseline.json
+    python -m benchmarks.codec --save benchmarks/codec_baseline.json
+    python -m benchmarks.codec --filter tsvrpc --profile /tmp/prof
+"""
+from __future__ import print_function
+
+import argparse
+import cProfile
+import json
+import os
+import platform
+import random
+import sys
+from timeit import default_timer
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from dongraetrader import kyoto
+from dongraetrader.serializer import BytesSerializer, TextSerializer
+
+
+COLUMN_COUNTS = (1, 8, 64)
+VALUE_SIZES = (16, 1024, 65536)
+CONTENTS = ("ascii", "binary")
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "codec_baseline.json")
+
+
+def make_value(size, content, rng):
+    if content == "ascii":
+        return bytes(bytearray(rng.randint(0x61, 0x7a) for _ in range(size)))
+    return bytes(bytearray(rng.randint(0, 0xff) for _ in range(size)))
+
+
+def make_records(columns, size, content, rng):
+    return [(('_k%d' % i).encode('ascii'), make_value(size, content, rng)) for i in range(columns)]
+
+
+def make_text(size, content):
+    return (u"a" if content == "ascii" else u"가") * (size // (1 if content == "ascii" else 3))
+
+
+def cases(quick=False, rng=None):
+    rng = rng or random.Random(0)
+    column_counts = COLUMN_COUNTS[:2] if quick else COLUMN_COUNTS
+    value_sizes = VALUE_SIZES[:2] if quick else VALUE_SIZES
+    encodings = (("url", kyoto.URLColumnEncoding()), ("b64", kyoto.Base64ColumnEncoding()))
+    for size in value_sizes:
+        for content in CONTENTS:
+            suffix = "size=%d,%s" % (size, content)
+            value = make_value(size, content, rng)
+            for name, encoding in encodings:
+                encoded = encoding.encode(value)
+                yield "%s.encode[%s]" % (name, suffix), encoding.encode, (value,)
+                yield "%s.decode[%s]" % (name, suffix), encoding.decode, (encoded,)
+            yield "bytes.serialize[%s]" % suffix, BytesSerializer().serialize, (value,)
+            text = make_text(size, content)
+            serializer = TextSerializer()
+            yield "text.serialize[%s]" % suffix, serializer.serialize, (text,)
+            yield "text.deserialize[%s]" % suffix, serializer.deserialize, (serializer.serialize(text),)
+            for columns in column_counts:
+                records = make_records(columns, size, content, rng)
+                for name, encoding in encodings:
+                    body = kyoto.TsvRpc.write(records, encoding)
+                    params = "columns=%d,%s" % (columns, suffix)
+                    yield "tsvrpc.write.%s[%s]" % (name, params), kyoto.TsvRpc.write, (records, encoding)
+                    yield "tsvrpc.read.%s[%s]" % (name, params), kyoto.TsvRpc.read, (body, encoding)
+    for columns in column_counts:
+        assoc = make_records(columns, 16, "ascii", rng)
+        last = assoc[-1][0]
+        yield "assoc_append[columns=%d]" % columns, lambda assoc=assoc: kyoto.assoc_append(list(assoc), b'k', b'v'), ()
+        yield "assoc_get[columns=%d]" % columns, kyoto.assoc_get, (assoc, last)
+        yield "assoc_find[columns=%d]" % columns, kyoto.assoc_find, (assoc, b'missing')
+
+
+def measure(func, args, min_time=0.2):
+    number = 1
+    while True:
+        start = default_timer()
+        for _ in range(number):
+            func(*args)
+        elapsed = default_timer() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed <= 0 else max(2, int(min_time / elapsed * 1.2))
+    result = {"ops": number / elapsed, "peak_bytes": None}
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            base = tracemalloc.get_traced_memory()[0]
+            func(*args)
+            result["peak_bytes"] = tracemalloc.get_traced_memory()[1] - base
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def run(quick=False, pattern=None, min_time=0.2, out=None):
+    results = {}
+    for name, func, args in cases(quick):
+        if pattern and pattern not in name:
+            continue
+        results[name] = measure(func, args, min_time)
+        if out:
+            print("%-60s %14.1f ops/s %10s B" % (name, results[name]["ops"], results[name]["peak_bytes"]), file=out)
+    return results
+
+
+def compare(results, baseline, tolerance=0.25):
+    regressions = []
+    for name, result in sorted(results.items()):
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if result["ops"] < expected["ops"] * (1 - tolerance):
+            regressions.append((name, "ops", expected["ops"], result["ops"]))
+        if None not in (result["peak_bytes"], expected["peak_bytes"]) and \
+                result["peak_bytes"] > expected["peak_bytes"] * (1 + tolerance) + 64:
+            regressions.append((name, "peak_bytes", expected["peak_bytes"], result["peak_bytes"]))
+    return regressions
+
+
+def profile(names, directory, quick=False, duration=0.5):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    selected = dict((name, (func, args)) for name, func, args in cases(quick) if name in names)
+    for name in names:
+        func, args = selected[name]
+        profiler = cProfile.Profile()
+        profiler.enable()
+        measure(func, args, duration)
+        profiler.disable()
+        profiler.dump_stats(os.path.join(directory, "".join(c if c.isalnum() or c in ".-" else "_" for c in name) + ".prof"))
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def save_baseline(path, results):
+    results = dict((name, {"ops": round(result["ops"], 1), "peak_bytes": result["peak_bytes"]}) for name, result in results.items())
+    with open(path, "w") as f:
+        json.dump({"python": platform.python_version(), "implementation": platform.python_implementation(),
+                   "results": results}, f, indent=1, sort_keys=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Codec microbenchmarks")
+    parser.add_argument("--quick", action="store_true", help="smaller sweep")
+    parser.add_argument("--filter", help="run only cases containing this string")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per case")
+    parser.add_argument("--baseline", help="compare against this baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--save", help="store the results as a baseline")
+    parser.add_argument("--profile", help="dump cProfile stats of the slowest cases into this directory")
+    parser.add_argument("--slowest", type=int, default=5)
+    options = parser.parse_args(argv)
+
+    results = run(options.quick, options.filter, options.min_time, sys.stdout)
+    if options.save:
+        save_baseline(options.save, results)
+    if options.profile:
+        slowest = sorted(results, key=lambda name: results[name]["ops"])[:options.slowest]
+        profile(slowest, options.profile, options.quick)
+    if options.baseline:
+        regressions = compare(results, load_baseline(options.baseline), options.tolerance)
+        for name, metric, expected, actual in regressions:
+            print("REGRESSION %s %s: %s -> %s" % (name, metric, expected, actual))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
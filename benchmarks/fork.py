@@ -0,0 +1,110 @@
+"""First request latency of freshly forked workers, like the workers of a preforking server.
+
+The parent opens a client and uses it, then forks workers. Each worker waits `--boot` seconds,
+as a worker does while it loads the application, and measures its first request. The run is
+repeated with and without warming the pool up after fork:
+
+    python -m benchmarks.fork --host localhost --port 1978
+    python -m benchmarks.fork --stand-in
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import struct
+import sys
+import threading
+from timeit import default_timer
+try:
+    from socketserver import ThreadingMixIn
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from SocketServer import ThreadingMixIn
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from dongraetrader.kyoto import KyotoTycoonClient
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/tab-separated-values")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_stand_in():
+    server = StandInServer(("127.0.0.1", 0), StandInHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def first_request_latency(client, boot):
+    # Only the calling thread survives fork, the rest of the work happens in the child.
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        status = 0
+        try:
+            threading.Event().wait(boot)
+            start = default_timer()
+            client.void()
+            os.write(w, struct.pack(str('>d'), default_timer() - start))
+        except Exception:
+            status = 1
+        finally:
+            os._exit(status)
+    os.close(w)
+    with os.fdopen(r, "rb") as f:
+        data = f.read()
+    os.waitpid(pid, 0)
+    return struct.unpack(str('>d'), data)[0] if data else None
+
+
+def measure(host, port, workers, boot, warm):
+    client = KyotoTycoonClient(host, port, pool_conf={"min": 2, "warm_after_fork": warm})
+    client.void()
+    latencies = [first_request_latency(client, boot) for _ in range(workers)]
+    return sorted(latency for latency in latencies if latency is not None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="First request latency of forked workers")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=1978)
+    parser.add_argument("--stand-in", action="store_true", help="use a local stand-in HTTP server")
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--boot", type=float, default=0.05, help="seconds a worker waits before its first request")
+    options = parser.parse_args(argv)
+
+    if not hasattr(os, "register_at_fork"):
+        print("os.register_at_fork is not available, the pool is rebuilt on the first request.")
+    host, port = options.host, options.port
+    if options.stand_in:
+        host, port = start_stand_in().server_address
+    for warm in (False, True):
+        latencies = measure(host, port, options.workers, options.boot, warm)
+        if not latencies:
+            print("warm_after_fork=%s: every worker failed" % warm)
+            continue
+        print("warm_after_fork=%-5s workers=%d median=%.3fms p90=%.3fms max=%.3fms" % (
+            warm, len(latencies), latencies[len(latencies) // 2] * 1000,
+            latencies[int(len(latencies) * 0.9)] * 1000, latencies[-1] * 1000))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import OrderedDict
+
+from .snapshot import MappedSnapshot, write_snapshot
+
+
+class NearCache(object):
+    """Small LRU cache of values close to the client. An entry lives for `ttl` seconds,
+    or until the expiration time of the record on the server if it is earlier.
+
+    A cache can be saved to a file and a new process can load it to start warm. The loaded
+    snapshot is memory-mapped and an entry is taken from it when it is asked for the first time.
+    Snapshot records are served up to `max_age` seconds after they were read from the server;
+    records not taken yet are carried over when the cache is saved again.
+
+    Only writes that invalidate the cache are seen; KyotoTycoonClient clears it after every script
+    call since a script may write any record. Writes by other processes need a replication
+    ChangeFeed with an invalidator, or a short ttl."""
+
+    def __init__(self, capacity=1024, ttl=1.0, clock=time.time):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.snapshot = None
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                value, xt, expire, at = entry
+                if expire > self.clock():
+                    self.entries[key] = entry
+                    return value, xt
+                return None
+            since = self.invalidations
+        snapshot = self.snapshot
+        if snapshot is not None:
+            found = snapshot.pop(key)
+            if found is not None:
+                value, xt, at = found
+                # An invalidation from another thread may have come after the pop.
+                if self.put(key, value, xt, since=since, at=at):
+                    return value, xt
+        return None
+
+    def put(self, key, value, xt=None, since=None, at=None):
+        # With `since`, a value read when `invalidations` was `since` is cached only if nothing was invalidated
+        # meanwhile; otherwise it may be older than a write that happened during the read.
+        # `at` is when the value was read from the server, now by default.
+        now = self.clock()
+        expire = now + self.ttl
+        if xt is not None and xt < expire:
+            expire = xt
+        with self.lock:
+            if since is not None and since != self.invalidations:
+                return False
+            self.entries.pop(key, None)
+            self.entries[key] = (value, xt, expire, now if at is None else at)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+            return True
+
+    def invalidate(self, key):
+        with self.lock:
+            self.invalidations += 1
+            self.entries.pop(key, None)
+        if self.snapshot is not None:
+            self.snapshot.discard(key)
+
+    def clear(self):
+        with self.lock:
+            self.invalidations += 1
+            self.entries.clear()
+        self.unload()
+
+    def load(self, path, key_serializer=None, value_serializer=None, max_age=3600):
+        self.unload()
+        self.snapshot = MappedSnapshot(path, key_serializer, value_serializer, self.clock, max_age)
+        return len(self.snapshot)
+
+    def unload(self):
+        snapshot, self.snapshot = self.snapshot, None
+        if snapshot is not None:
+            snapshot.close()
+
+    def save(self, path, key_serializer=None, value_serializer=None):
+        now = self.clock()
+        with self.lock:
+            # An entry past its local ttl is still worth a warm start until the record expires on the server.
+            records = [(key, value, xt, at) for key, (value, xt, expire, at) in self.entries.items() if xt is None or xt > now]
+        snapshot = self.snapshot
+        raw_records = snapshot.raw_records() if snapshot is not None else ()
+        return write_snapshot(path, records, key_serializer, value_serializer, raw_records, self.clock)
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,126 @@
+import os
+import struct
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+from .kyoto import KyotoError, LogicalInconsistencyError, binary_type
+
+
+Manifest = struct.Struct(str('>4sQIIQ'))
+
+
+class ChunkedStore(object):
+    """Stores a large value as fixed size chunks under derived keys plus a manifest record
+    under the key itself. Chunks are transferred in parallel over the pooled connections of
+    `client`, which must be configured with a BytesSerializer for values. At most `window`
+    chunks are in flight, which bounds the memory used by a transfer."""
+
+    MAGIC = b'DTLO'
+    REMOVE_BATCH = 256
+
+    def __init__(self, client, chunk_size=1 << 20, workers=4, window=None):
+        self.client = client
+        self.chunk_size = chunk_size
+        self.window = window or workers * 2
+        self.executor = ThreadPool(workers)
+
+    def close(self):
+        self.executor.close()
+        self.executor.join()
+
+    def _chunk_key(self, key, nonce, i):
+        suffix = "\x00%016x\x00%d" % (nonce, i)
+        return key + (suffix.encode('ascii') if isinstance(key, binary_type) else suffix)
+
+    def _chunk_keys(self, key, manifest):
+        size, chunk_size, count, nonce = manifest
+        return [self._chunk_key(key, nonce, i) for i in range(count)]
+
+    def _parallel(self, func, args_list):
+        # Yields results in order while keeping at most `window` calls in flight.
+        pending = deque()
+        try:
+            for args in args_list:
+                pending.append(self.executor.apply_async(func, args))
+                if len(pending) >= self.window:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+        finally:
+            for result in pending:
+                result.wait()
+
+    def _remove(self, keys):
+        for i in range(0, len(keys), self.REMOVE_BATCH):
+            self.client.remove_bulk(keys[i:i + self.REMOVE_BATCH])
+
+    def manifest(self, key):
+        value, xt = self.client.get(key)
+        try:
+            magic, size, chunk_size, count, nonce = Manifest.unpack(value)
+        except struct.error:
+            magic = None
+        if magic != self.MAGIC:
+            raise KyotoError("%r is not a chunked value" % (key,))
+        return size, chunk_size, count, nonce
+
+    def _find_manifest(self, key):
+        try:
+            return self.manifest(key)
+        except LogicalInconsistencyError:
+            return None
+
+    def put(self, key, data, xt=None):
+        read = data.read if hasattr(data, "read") else None
+        nonce = struct.unpack(str('>Q'), os.urandom(8))[0]
+        sizes = []
+
+        def chunks():
+            i = 0
+            while True:
+                if read:
+                    chunk = read(self.chunk_size)
+                else:
+                    chunk = data[i * self.chunk_size:(i + 1) * self.chunk_size]
+                if not chunk and i > 0:
+                    return
+                sizes.append(len(chunk))
+                yield self._chunk_key(key, nonce, i), chunk, xt
+                i += 1
+                if len(chunk) < self.chunk_size:
+                    return
+
+        old = self._find_manifest(key)
+        try:
+            for _ in self._parallel(self.client.set, chunks()):
+                pass
+            manifest = (sum(sizes), self.chunk_size, len(sizes), nonce)
+            self.client.set(key, Manifest.pack(self.MAGIC, *manifest), xt=xt)
+        except Exception:
+            self._remove([self._chunk_key(key, nonce, i) for i in range(len(sizes))])
+            raise
+        if old:
+            self._remove(self._chunk_keys(key, old))
+        return manifest[0]
+
+    def get(self, key, out=None):
+        manifest = self.manifest(key)
+        buffer = [] if out is None else None
+        write = buffer.append if out is None else out.write
+        size = 0
+        try:
+            for value, xt in self._parallel(self.client.get, [(k,) for k in self._chunk_keys(key, manifest)]):
+                write(value)
+                size += len(value)
+        except LogicalInconsistencyError:
+            raise KyotoError("%r was changed while reading it" % (key,))
+        if size != manifest[0]:
+            raise KyotoError("%r was changed while reading it" % (key,))
+        return b''.join(buffer) if out is None else size
+
+    def remove(self, key):
+        manifest = self._find_manifest(key)
+        if manifest is None:
+            return False
+        self._remove([key] + self._chunk_keys(key, manifest))
+        return True
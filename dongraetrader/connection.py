@@ -1,6 +1,8 @@
 import logging
 import os
+import threading
 import time
+import weakref
 try:
     from queue import LifoQueue, Full, Empty
 except ImportError:
@@ -19,20 +21,80 @@ class Connection(object):
     def close(self):
         raise NotImplementedError
 
+    def discard(self):
+        # Called in a forked child for a connection inherited from the parent. Closing our copy of the
+        # descriptor is enough, it must not shut down the connection the parent is still using.
+        self.close()
+
     def touch(self):
         self.access_time = time.time()
 
 
+_pools = weakref.WeakSet()
+
+
+def _before_fork():
+    for pool in list(_pools):
+        pool._before_fork()
+
+
+def _after_fork_in_parent():
+    for pool in list(_pools):
+        pool._after_fork_in_parent()
+
+
+def _after_fork_in_child():
+    for pool in list(_pools):
+        pool._after_fork_in_child()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(before=_before_fork, after_in_parent=_after_fork_in_parent, after_in_child=_after_fork_in_child)
+
+
 class ConnectionPool(object):
     def __init__(self, conf, connection_class, **connection_kwargs):
         self.pid = os.getpid()
-        self.conf = {"max": 0, "min": 1, "timeout": 0.1, "idle_timeout": 60, "max_lifetime": 30 * 60}
+        self.conf = {"max": 0, "min": 1, "timeout": 0.1, "idle_timeout": 60, "max_lifetime": 30 * 60, "warm_after_fork": True}
         if conf:
             self.conf.update(conf)
         self.connection_class = connection_class
         self.connection_kwargs = connection_kwargs
         self.pool = LifoQueue(self.conf["max"])
         self.diet()
+        _pools.add(self)
+
+    def _before_fork(self):
+        # Keep other threads from being in the middle of a get or put, the child inherits a consistent queue.
+        self.pool.mutex.acquire()
+
+    def _after_fork_in_parent(self):
+        self.pool.mutex.release()
+
+    def _after_fork_in_child(self):
+        self.pool.mutex.release()
+        inherited = list(self.pool.queue)
+        self.pid = os.getpid()
+        self.pool = LifoQueue(self.conf["max"])
+        for conn in inherited:
+            if conn:
+                conn.discard()
+        if self.conf["warm_after_fork"]:
+            warmer = threading.Thread(target=self.warm, name="%s-warm" % self.__class__.__name__)
+            warmer.daemon = True
+            warmer.start()
+        else:
+            self.diet()
+
+    def warm(self):
+        for i in range(self.conf["min"]):
+            try:
+                conn = self.connection_class(**self.connection_kwargs)
+            except Exception as e:
+                logger.warning("Cannot open a connection ahead, open on demand. %s" % e)
+                self.diet()
+                break
+            self.release(conn)
 
     def _checkpid(self):
         if self.pid != os.getpid():
@@ -1,6 +1,11 @@
 from __future__ import unicode_literals
 import io
 import base64
+from array import array
+try:
+    from collections.abc import Mapping, Sequence
+except ImportError:
+    from collections import Mapping, Sequence
 try:
     from urllib.parse import quote_from_bytes, unquote_to_bytes
 except ImportError:
@@ -24,6 +29,9 @@ from .serializer import StrSerializer
 
 
 class ColumnEncoding(object):
+    # Whether unreserved characters like "_" are left as they are, so a prefix can be checked without decoding.
+    PRESERVES_UNRESERVED = False
+
     def __init__(self, name):
         self.name = name
 
@@ -35,6 +43,8 @@ class ColumnEncoding(object):
 
 
 class RawColumnEncoding(ColumnEncoding):
+    PRESERVES_UNRESERVED = True
+
     def __init__(self):
         super(RawColumnEncoding, self).__init__(None)
 
@@ -46,6 +56,8 @@ class RawColumnEncoding(ColumnEncoding):
 
 
 class URLColumnEncoding(ColumnEncoding):
+    PRESERVES_UNRESERVED = True
+
     def __init__(self):
         super(URLColumnEncoding, self).__init__("U")
 
@@ -118,6 +130,19 @@ class TsvRpc(object):
                 result.append(tuple(encoding.decode(column) for column in columns))
         return result
 
+    @classmethod
+    def scan(cls, s):
+        # Yields (start, tab, end) offsets of every row without copying it. tab is -1 for a one-column row.
+        pos = 0
+        length = len(s)
+        while pos < length:
+            end = s.find(cls.RECORD_SEPARATOR, pos)
+            if end < 0:
+                end = length
+            if end > pos:
+                yield pos, s.find(cls.COLUMN_SEPARATOR, pos, end), end
+            pos = end + 1
+
     @classmethod
     def write(cls, records, encoding):
         buffer = io.BytesIO()
@@ -135,6 +160,70 @@ class TsvRpc(object):
             buffer.close()
 
 
+class LazyRecords(Mapping):
+    def __init__(self, s, encoding, prefix, key_serializer, value_serializer):
+        self.s = s
+        self.encoding = encoding
+        self.key_serializer = key_serializer
+        self.value_serializer = value_serializer
+        self.index = {}
+        for start, tab, end in TsvRpc.scan(s):
+            if tab < 0:
+                continue
+            key = encoding.decode(s[start:tab])
+            if key.startswith(prefix):
+                self.index[key[len(prefix):]] = tab + 1
+
+    def __getitem__(self, key):
+        start = self.index[self.key_serializer.serialize(key)]
+        end = self.s.find(TsvRpc.RECORD_SEPARATOR, start)
+        if end < 0:
+            end = len(self.s)
+        return self.value_serializer.deserialize(self.encoding.decode(self.s[start:end]))
+
+    def __contains__(self, key):
+        return self.key_serializer.serialize(key) in self.index
+
+    def __iter__(self):
+        for key in self.index:
+            yield self.key_serializer.deserialize(key)
+
+    def __len__(self):
+        return len(self.index)
+
+
+class LazyKeys(Sequence):
+    def __init__(self, s, encoding, prefix, key_serializer):
+        self.s = s
+        self.encoding = encoding
+        self.prefix = prefix
+        self.key_serializer = key_serializer
+        self.offsets = array(str('l'))
+        for start, tab, end in TsvRpc.scan(s):
+            if encoding.PRESERVES_UNRESERVED:
+                matched = s.startswith(prefix, start)
+            else:
+                matched = encoding.decode(s[start:end if tab < 0 else tab]).startswith(prefix)
+            if matched:
+                self.offsets.append(start)
+
+    def _key_at(self, start):
+        end = self.s.find(TsvRpc.RECORD_SEPARATOR, start)
+        if end < 0:
+            end = len(self.s)
+        tab = self.s.find(TsvRpc.COLUMN_SEPARATOR, start, end)
+        key = self.encoding.decode(self.s[start:end if tab < 0 else tab])
+        return self.key_serializer.deserialize(key[len(self.prefix):])
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._key_at(start) for start in self.offsets[i]]
+        return self._key_at(self.offsets[i])
+
+    def __len__(self):
+        return len(self.offsets)
+
+
 class KyotoError(Exception):
     pass
 
@@ -143,6 +232,13 @@ class LogicalInconsistencyError(KyotoError):
     pass
 
 
+def tsvrpc_error(status, message):
+    if status == 450:
+        return LogicalInconsistencyError(message)
+    else:
+        return KyotoError(message)
+
+
 class KyotoTycoonConnection(Connection):
     NAME_KEY = b'key'
     NAME_VALUE = b'value'
@@ -154,13 +250,17 @@ class KyotoTycoonConnection(Connection):
     NAME_PREFIX = b'prefix'
     NAME_MAX = b'max'
     NAME_VSIZ = b'vsiz'
+    NAME_NAME = b'name'
     NAME__ = b'_'
     NAME_ERROR = b'ERROR'
+    NAME_DOT = b'.'
+
+    BATCH_SCRIPT = "batch"
 
-    def __init__(self, host, port, timeout=None):
+    def __init__(self, host, port, timeout=None, key_serializer=None, value_serializer=None):
         super(KyotoTycoonConnection, self).__init__([HTTPException])
-        self.key_serializer = StrSerializer()
-        self.value_serializer = StrSerializer()
+        self.key_serializer = key_serializer or StrSerializer()
+        self.value_serializer = value_serializer or StrSerializer()
         self.connection = HTTPConnection(host, port, timeout=timeout)
         self.connection.connect()
         self.str = "%s#%d(%s:%d)" % (self.__class__.__name__, id(self), host, port)
@@ -201,6 +301,10 @@ class KyotoTycoonConnection(Connection):
         return self.value_serializer.deserialize(b)
 
     def call(self, name, input):
+        x, out_encoding = self.call_raw(name, input)
+        return TsvRpc.read(x, out_encoding)
+
+    def call_raw(self, name, input):
         in_encoding = URLColumnEncoding()
         body = TsvRpc.write(input, in_encoding)
         headers = {"Content-Type": TsvRpc.content_type_for(in_encoding)}
@@ -209,14 +313,11 @@ class KyotoTycoonConnection(Connection):
         status, reason = response.status, response.reason
         out_encoding = TsvRpc.column_encoding_for(response.getheader("Content-Type"))
         x = response.read()
-        output = TsvRpc.read(x, out_encoding) if out_encoding else None
         if status == 200:
-            return output
+            return x, out_encoding
+        output = TsvRpc.read(x, out_encoding)
         message = self._decode_text(assoc_get(output, self.NAME_ERROR) if output else reason)
-        if status == 450:
-            raise LogicalInconsistencyError(message)
-        else:
-            raise KyotoError(message)
+        raise tsvrpc_error(status, message)
 
     def void(self):
         self.call("void", [])
@@ -291,31 +392,72 @@ class KyotoTycoonConnection(Connection):
         output = self.call("remove_bulk", input)
         return int(assoc_get(output, self.NAME_NUM))
 
-    def get_bulk(self, keys, atomic=None, db=None):
+    def get_bulk(self, keys, atomic=None, db=None, lazy=False):
         input = []
         if atomic:
             assoc_append(input, self.NAME_ATOMIC, b'')
         assoc_append_if_not_none(input, self.NAME_DB, db)
         for key in keys:
             assoc_append(input, self.NAME__ + self._key_ser(key), b'')
+        if lazy:
+            x, out_encoding = self.call_raw("get_bulk", input)
+            return LazyRecords(x, out_encoding, self.NAME__, self.key_serializer, self.value_serializer)
         output = self.call("get_bulk", input)
         return dict([(self._key_deser(k[1:]), self._value_deser(v)) for k, v in output if k.startswith(self.NAME__)])
 
-    def match_prefix(self, prefix, max=None, db=None):
+    def match_prefix(self, prefix, max=None, db=None, lazy=False):
         input = []
         assoc_append(input, self.NAME_PREFIX, self._key_ser(prefix))
         assoc_append_if_not_none(input, self.NAME_MAX, self._encode_int(max))
         assoc_append_if_not_none(input, self.NAME_DB, db)
+        if lazy:
+            x, out_encoding = self.call_raw("match_prefix", input)
+            return LazyKeys(x, out_encoding, self.NAME__, self.key_serializer)
         output = self.call("match_prefix", input)
         return [self._key_deser(k[1:]) for k, v in output if k.startswith(self.NAME__)]
 
+    def play_script(self, name, records):
+        input = []
+        assoc_append(input, self.NAME_NAME, self._encode_text(name))
+        for k, v in records.items():
+            assoc_append(input, self.NAME__ + self._key_ser(k), self._value_ser(v))
+        output = self.call("play_script", input)
+        return {self._key_deser(k[1:]): self._value_deser(v) for k, v in output if k.startswith(self.NAME__)}
+
+    def play_script_batch(self, calls, script=None):
+        # Every call is multiplexed into one play_script request of the dispatcher procedure
+        # (see lua/batch.lua). "_<i>" carries the procedure name of the i-th call and
+        # "_<i>.<key>" its records. Outputs come back as "_<i>.<key>".
+        input = []
+        assoc_append(input, self.NAME_NAME, self._encode_text(script or self.BATCH_SCRIPT))
+        for i, (name, records) in enumerate(calls):
+            index = self._encode_int(i)
+            assoc_append(input, self.NAME__ + index, self._encode_text(name))
+            for k, v in records.items():
+                assoc_append(input, self.NAME__ + index + self.NAME_DOT + self._key_ser(k), self._value_ser(v))
+        output = self.call("play_script", input)
+        result = [{} for _ in calls]
+        for k, v in output:
+            if not k.startswith(self.NAME__):
+                continue
+            index, dot, key = k[1:].partition(self.NAME_DOT)
+            if dot:
+                result[self._decode_int(index)][self._key_deser(key)] = self._value_deser(v)
+        return result
+
 
 class KyotoTycoonClient(object):
-    def __init__(self, host, port, db=None, timeout=1, pool_conf=None):
+    def __init__(self, host, port, db=None, timeout=1, pool_conf=None, key_serializer=None, value_serializer=None,
+                 sampler=None, near_cache=None):
         self.host = host
         self.port = port
         self.db = db
-        self.pool = ConnectionPool(pool_conf, KyotoTycoonConnection, host=host, port=port, timeout=timeout)
+        self.key_serializer = key_serializer or StrSerializer()
+        self.value_serializer = value_serializer or StrSerializer()
+        self.pool = ConnectionPool(pool_conf, KyotoTycoonConnection, host=host, port=port, timeout=timeout,
+                                   key_serializer=self.key_serializer, value_serializer=self.value_serializer)
+        self.sampler = sampler
+        self.near_cache = near_cache
 
     def __str__(self):
         return "%s#%d(%s:%d/%s)" % (self.__class__.__name__, id(self), self.host, self.port, self.db)
@@ -323,6 +465,17 @@ class KyotoTycoonClient(object):
     def dispose(self):
         self.pool.disconnect()
 
+    def _sample(self, op, key, value=None):
+        if self.sampler is not None:
+            self.sampler.record(op, key, 0 if value is None else lambda: len(self.value_serializer.serialize(value)))
+
+    def _invalidate(self, key):
+        if self.near_cache is not None:
+            self.near_cache.invalidate(key)
+
+    def hot_keys(self, n=None):
+        return self.sampler.snapshot(n) if self.sampler is not None else {}
+
     def void(self):
         with self.pool.connection() as c:
             c.void()
@@ -334,35 +487,84 @@ class KyotoTycoonClient(object):
     def clear(self):
         with self.pool.connection() as c:
             c.clear(db=self.db)
+        self._invalidate_all()
 
     def set(self, key, value, xt=None):
+        self._sample("set", key, value)
         with self.pool.connection() as c:
             c.set(key, value, xt=xt, db=self.db)
+        self._invalidate(key)
 
     def add(self, key, value, xt=None):
+        self._sample("add", key, value)
         with self.pool.connection() as c:
             c.add(key, value, xt=xt, db=self.db)
+        self._invalidate(key)
 
     def increment(self, key, num, orig=None, xt=None):
+        self._sample("increment", key)
         with self.pool.connection() as c:
-            return c.increment(key, num, orig=orig, xt=xt, db=self.db)
+            num = c.increment(key, num, orig=orig, xt=xt, db=self.db)
+        self._invalidate(key)
+        return num
 
     def get(self, key):
+        if self.near_cache is not None:
+            cached = self.near_cache.get(key)
+            if cached is not None:
+                self._sample("get", key, cached[0])
+                return cached
+            # A write through this client while we read must not be overwritten by the value we read.
+            since = self.near_cache.invalidations
         with self.pool.connection() as c:
-            return c.get(key, db=self.db)
+            value, xt = c.get(key, db=self.db)
+        self._sample("get", key, value)
+        if self.near_cache is not None and self.sampler is not None and self.sampler.is_hot("get", key):
+            self.near_cache.put(key, value, xt, since=since)
+        return value, xt
 
     def check(self, key):
         with self.pool.connection() as c:
             return c.check(key, db=self.db)
 
     def remove_bulk(self, keys, atomic=None):
+        keys = list(keys)
         with self.pool.connection() as c:
-            return c.remove_bulk(keys, atomic=atomic, db=self.db)
+            num = c.remove_bulk(keys, atomic=atomic, db=self.db)
+        for key in keys:
+            self._sample("remove_bulk", key)
+            self._invalidate(key)
+        return num
 
-    def get_bulk(self, keys, atomic=None):
+    def get_bulk(self, keys, atomic=None, lazy=False):
+        keys = list(keys)
         with self.pool.connection() as c:
-            return c.get_bulk(keys, atomic=atomic, db=self.db)
-
-    def match_prefix(self, prefix, max=None):
+            records = c.get_bulk(keys, atomic=atomic, db=self.db, lazy=lazy)
+        if self.sampler is not None:
+            # Measuring the size of a lazy result would decode every value.
+            for key in keys:
+                self._sample("get_bulk", key, None if lazy else records.get(key))
+        return records
+
+    def match_prefix(self, prefix, max=None, lazy=False):
         with self.pool.connection() as c:
-            return c.match_prefix(prefix, max=max, db=self.db)
+            return c.match_prefix(prefix, max=max, db=self.db, lazy=lazy)
+
+    def _invalidate_all(self):
+        # A script may write any record.
+        if self.near_cache is not None:
+            self.near_cache.clear()
+
+    def play_script(self, name, records):
+        try:
+            with self.pool.connection() as c:
+                return c.play_script(name, records)
+        finally:
+            self._invalidate_all()
+
+    def play_script_batch(self, calls, script=None):
+        try:
+            with self.pool.connection() as c:
+                return c.play_script_batch(calls, script=script)
+        finally:
+            self._invalidate_all()
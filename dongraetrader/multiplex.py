@@ -0,0 +1,290 @@
+import errno
+import socket
+import time
+from collections import deque
+try:
+    import selectors
+except ImportError:
+    import selectors34 as selectors
+
+from .kyoto import KyotoError, TsvRpc, URLColumnEncoding, assoc_find, tsvrpc_error
+
+clock = getattr(time, "monotonic", time.time)
+
+
+class DeadlineExceeded(KyotoError):
+    pass
+
+
+def _would_block(e):
+    return e.args and e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK)
+
+
+class RpcCall(object):
+    def __init__(self, node, name, input, deadline):
+        self.node = node
+        self.name = name
+        self.input = input
+        self.deadline = deadline
+        self.channel = None
+        self.retried = False
+        self.done = False
+        self.output = None
+        self.error = None
+
+    def __str__(self):
+        return "%s#%d(%s:%d/%s)" % (self.__class__.__name__, id(self), self.node[0], self.node[1], self.name)
+
+    def result(self):
+        if not self.done:
+            raise KyotoError("%s is not done yet" % self)
+        if self.error is not None:
+            raise self.error
+        return self.output
+
+    def _complete(self, output=None, error=None):
+        self.done = True
+        self.output = output
+        self.error = error
+        self.channel = None
+
+
+class Channel(object):
+    """A non-blocking keep-alive HTTP connection running one RPC at a time."""
+
+    HEADER_END = b'\r\n\r\n'
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, node):
+        self.node = node
+        family, type, proto, _, address = socket.getaddrinfo(node[0], node[1], 0, socket.SOCK_STREAM)[0]
+        self.sock = socket.socket(family, type, proto)
+        self.sock.setblocking(False)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        err = self.sock.connect_ex(address)
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self.sock.close()
+            raise socket.error(err, "Cannot connect to %s:%d" % node)
+        self.connected = False
+        self.served = 0
+        self.call = None
+        self.out = None
+        self.received = bytearray()
+        self.response = None
+
+    def close(self):
+        self.sock.close()
+
+    def start(self, call):
+        in_encoding = URLColumnEncoding()
+        body = TsvRpc.write(call.input, in_encoding)
+        head = "POST /rpc/%s HTTP/1.1\r\nHost: %s:%d\r\nContent-Type: %s\r\nContent-Length: %d\r\n\r\n" % (
+            call.name, self.node[0], self.node[1], TsvRpc.content_type_for(in_encoding), len(body))
+        self.call = call
+        self.out = memoryview(head.encode('ascii') + body)
+        self.received = bytearray()
+        self.response = None
+        call.channel = self
+
+    def on_writable(self):
+        if not self.connected:
+            err = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                raise socket.error(err, "Cannot connect to %s:%d" % self.node)
+            self.connected = True
+        try:
+            self.out = self.out[self.sock.send(self.out):]
+        except socket.error as e:
+            if _would_block(e):
+                return False
+            raise
+        return len(self.out) == 0
+
+    def on_readable(self):
+        try:
+            data = self.sock.recv(self.READ_SIZE)
+        except socket.error as e:
+            if _would_block(e):
+                return None
+            raise
+        if not data:
+            if self.response is not None and self.response[3] is None:
+                # The body is delimited by the end of the connection.
+                return self._parse(True)
+            raise KyotoError("Connection to %s:%d was closed" % self.node)
+        self.received += data
+        return self._parse(False)
+
+    def may_retry(self):
+        # A kept-alive connection the server closed before it sent anything, the request was not served.
+        return self.served > 0 and self.response is None and not self.received
+
+    def _parse(self, closed):
+        if self.response is None:
+            end = self.received.find(self.HEADER_END)
+            if end < 0:
+                return None
+            lines = bytes(self.received[:end]).decode('iso-8859-1').split('\r\n')
+            del self.received[:end + len(self.HEADER_END)]
+            version, status, reason = (lines[0].split(' ', 2) + [''])[:3]
+            headers = {}
+            for line in lines[1:]:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            if 'chunked' in headers.get('transfer-encoding', ''):
+                raise KyotoError("Chunked transfer encoding is not supported")
+            length = headers.get('content-length')
+            try:
+                self.response = (int(status), reason, headers, None if length is None else int(length))
+            except ValueError:
+                raise KyotoError("Malformed response from %s:%d: %r" % (self.node + (lines[0],)))
+        status, reason, headers, length = self.response
+        if (length is None and not closed) or (length is not None and len(self.received) < length):
+            return None
+        body = bytes(self.received if length is None else self.received[:length])
+        keep_alive = length is not None and headers.get('connection', '').lower() != 'close'
+        return status, reason, headers, body, keep_alive
+
+
+class Multiplexer(object):
+    """Drives many RPCs over many connections and nodes from one thread with non-blocking
+    sockets. Calls are submitted per node (a (host, port) pair), run over up to
+    `max_connections` keep-alive connections of the node, and fail with DeadlineExceeded
+    when they are not done within their timeout."""
+
+    def __init__(self, max_connections=4, timeout=1):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.selector = selectors.DefaultSelector()
+        self.channels = {}
+        self.queues = {}
+        self.pending = set()
+
+    def close(self):
+        for channels in self.channels.values():
+            for channel in list(channels):
+                self._close_channel(channel, KyotoError("%s was closed" % self.__class__.__name__))
+        self.selector.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def submit(self, node, name, input, timeout=None):
+        call = RpcCall(node, name, input, clock() + (self.timeout if timeout is None else timeout))
+        self.queues.setdefault(node, deque()).append(call)
+        self.pending.add(call)
+        return call
+
+    def batch(self, requests, count=None, timeout=None):
+        calls = [self.submit(node, name, input) for node, name, input in requests]
+        self.wait(calls, count, timeout)
+        return calls
+
+    def wait(self, calls, count=None, timeout=None):
+        count = len(calls) if count is None else count
+        until = None if timeout is None else clock() + timeout
+        while True:
+            now = clock()
+            self._expire(now)
+            done = [call for call in calls if call.done]
+            if len(done) >= count or not self.pending or until is not None and now >= until:
+                return done
+            # Drop kept-alive connections the server closed meanwhile before they get a call.
+            self._poll(0)
+            self._dispatch()
+            if not self.pending:
+                continue
+            wait = min(call.deadline for call in self.pending) - now
+            if until is not None:
+                wait = min(wait, until - now)
+            self._poll(max(wait, 0))
+
+    def _dispatch(self):
+        for node, queue in self.queues.items():
+            channels = self.channels.setdefault(node, [])
+            while queue:
+                channel = next((c for c in channels if c.call is None), None)
+                if channel is None:
+                    if len(channels) >= self.max_connections:
+                        break
+                    try:
+                        channel = Channel(node)
+                    except socket.error as e:
+                        self._finish(queue.popleft(), error=e)
+                        continue
+                    channels.append(channel)
+                    self.selector.register(channel.sock, selectors.EVENT_WRITE, channel)
+                else:
+                    self.selector.modify(channel.sock, selectors.EVENT_WRITE, channel)
+                channel.start(queue.popleft())
+
+    def _poll(self, timeout):
+        for key, events in self.selector.select(timeout):
+            channel = key.data
+            try:
+                if events & selectors.EVENT_WRITE:
+                    if channel.on_writable():
+                        self.selector.modify(channel.sock, selectors.EVENT_READ, channel)
+                elif events & selectors.EVENT_READ:
+                    if channel.call is None:
+                        # An idle connection is readable only when the server closed it.
+                        raise KyotoError("Connection to %s:%d was closed" % channel.node)
+                    response = channel.on_readable()
+                    if response is not None:
+                        self._respond(channel, *response)
+            except Exception as e:
+                # Whatever went wrong, the call must finish and the connection must not be reused.
+                call = channel.call
+                if call is not None and not call.retried and channel.may_retry():
+                    call.retried = True
+                    channel.call = None
+                    call.channel = None
+                    self.queues[call.node].appendleft(call)
+                self._close_channel(channel, e)
+
+    def _respond(self, channel, status, reason, headers, body, keep_alive):
+        content_type = headers.get('content-type', 'text/tab-separated-values')
+        try:
+            out_encoding = TsvRpc.column_encoding_for(content_type)
+        except KeyError:
+            raise KyotoError("Unexpected response from %s:%d: %d %s (%s)" % (channel.node + (status, reason, content_type)))
+        output = TsvRpc.read(body, out_encoding)
+        call = channel.call
+        channel.call = None
+        if status == 200:
+            self._finish(call, output=output)
+        else:
+            message = assoc_find(output, b'ERROR')
+            self._finish(call, error=tsvrpc_error(status, message.decode('utf-8') if message else reason))
+        if keep_alive:
+            channel.served += 1
+        else:
+            self._close_channel(channel, None)
+
+    def _expire(self, now):
+        for call in [call for call in self.pending if call.deadline <= now]:
+            error = DeadlineExceeded("%s exceeded its deadline" % call)
+            if call.channel is not None:
+                # The response may still come, the connection cannot be reused.
+                self._close_channel(call.channel, error)
+            else:
+                self.queues[call.node].remove(call)
+                self._finish(call, error=error)
+
+    def _close_channel(self, channel, error):
+        if channel not in self.channels[channel.node]:
+            return
+        self.selector.unregister(channel.sock)
+        channel.close()
+        self.channels[channel.node].remove(channel)
+        if channel.call is not None:
+            self._finish(channel.call, error=error)
+            channel.call = None
+
+    def _finish(self, call, output=None, error=None):
+        call._complete(output, error)
+        self.pending.discard(call)
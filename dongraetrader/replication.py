@@ -0,0 +1,181 @@
+import logging
+import socket
+import struct
+import threading
+import time
+from collections import namedtuple
+
+from .kyoto import KyotoError
+from .serializer import StrSerializer
+
+
+logger = logging.getLogger(__name__)
+
+
+ChangeEvent = namedtuple('ChangeEvent', ['ts', 'sid', 'db', 'op', 'key', 'value', 'xt'])
+
+
+def read_varnum(buf, pos):
+    num = 0
+    while True:
+        c = buf[pos]
+        pos += 1
+        num = (num << 7) | (c & 0x7f)
+        if c < 0x80:
+            return num, pos
+
+
+class ReplicationClient(object):
+    MAGIC_NOP = 0xb0
+    MAGIC_REPLICATION = 0xb1
+
+    OP_SET = 0xa1
+    OP_REMOVE = 0xa2
+    OP_CLEAR = 0xa3
+
+    XT_WIDTH = 5
+    XT_MAX = (1 << (XT_WIDTH * 8)) - 1
+
+    HANDSHAKE = struct.Struct(str('>BIQH'))
+    HEADER = struct.Struct(str('>QI'))
+    LOG_HEADER = struct.Struct(str('>HHB'))
+
+    def __init__(self, host, port, ts=0, sid=0, timeout=None, key_serializer=None, value_serializer=None):
+        self.host = host
+        self.port = port
+        self.ts = ts
+        self.sid = sid
+        self.timeout = timeout
+        self.key_serializer = key_serializer or StrSerializer()
+        self.value_serializer = value_serializer or StrSerializer()
+        self.socket = None
+
+    def __str__(self):
+        return "%s#%d(%s:%d@%d)" % (self.__class__.__name__, id(self), self.host, self.port, self.ts)
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def __iter__(self):
+        while True:
+            yield self.read()
+
+    def open(self):
+        self.socket = socket.create_connection((self.host, self.port), self.timeout)
+        self.socket.sendall(self.HANDSHAKE.pack(self.MAGIC_REPLICATION, 0, self.ts, self.sid))
+        if bytearray(self._receive(1))[0] != self.MAGIC_REPLICATION:
+            self.close()
+            raise KyotoError("Replication was refused by %s:%d" % (self.host, self.port))
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+    def read(self):
+        while True:
+            magic = bytearray(self._receive(1))[0]
+            if magic == self.MAGIC_NOP:
+                self.socket.sendall(struct.pack(str('>B'), self.MAGIC_REPLICATION))
+            elif magic == self.MAGIC_REPLICATION:
+                ts, size = self.HEADER.unpack(self._receive(self.HEADER.size))
+                self.ts = ts
+                message = bytearray(self._receive(size))
+                try:
+                    event = self._decode(ts, message)
+                except (struct.error, IndexError, ValueError) as e:
+                    raise KyotoError("Malformed update log entry at %d. %s" % (ts, e))
+                if event is not None:
+                    return event
+            else:
+                raise KyotoError("Unexpected replication message 0x%02x" % magic)
+
+    def _receive(self, size):
+        chunks = []
+        while size > 0:
+            chunk = self.socket.recv(size)
+            if not chunk:
+                raise KyotoError("Replication stream was closed by %s:%d" % (self.host, self.port))
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+    def _decode(self, ts, buf):
+        sid, db, op = self.LOG_HEADER.unpack_from(buf)
+        pos = self.LOG_HEADER.size
+        if op == self.OP_SET:
+            ksiz, pos = read_varnum(buf, pos)
+            vsiz, pos = read_varnum(buf, pos)
+            key = bytes(buf[pos:pos + ksiz])
+            pos += ksiz
+            xt = 0
+            for c in buf[pos:pos + self.XT_WIDTH]:
+                xt = (xt << 8) | c
+            value = bytes(buf[pos + self.XT_WIDTH:pos + vsiz])
+            return ChangeEvent(ts, sid, db, "set", self.key_serializer.deserialize(key),
+                               self.value_serializer.deserialize(value), None if xt >= self.XT_MAX else xt)
+        elif op == self.OP_REMOVE:
+            ksiz, pos = read_varnum(buf, pos)
+            key = bytes(buf[pos:pos + ksiz])
+            return ChangeEvent(ts, sid, db, "remove", self.key_serializer.deserialize(key), None, None)
+        elif op == self.OP_CLEAR:
+            return ChangeEvent(ts, sid, db, "clear", None, None, None)
+        logger.debug("Skip unknown update log operation 0x%02x at %d." % (op, ts))
+        return None
+
+
+class ChangeFeed(object):
+    def __init__(self, listener, host, port, ts=0, sid=0, timeout=None, retry_interval=1.0, **client_kwargs):
+        self.listener = listener
+        self.client = ReplicationClient(host, port, ts=ts, sid=sid, timeout=timeout, **client_kwargs)
+        self.retry_interval = retry_interval
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=str(self.client))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        sock = self.client.socket
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def run(self):
+        while self.running:
+            try:
+                self.client.open()
+                # Resume from the last log entry when reconnected.
+                for event in self.client:
+                    try:
+                        self.listener(event)
+                    except Exception:
+                        logger.exception("Listener failed on %s." % (event,))
+            except (KyotoError, socket.error) as e:
+                if self.running:
+                    logger.warning("Replication from %s failed, retry. %s" % (self.client, e))
+                    time.sleep(self.retry_interval)
+            finally:
+                self.client.close()
+
+
+def invalidator(cache):
+    def listener(event):
+        if event.op == "clear":
+            cache.clear()
+        else:
+            cache.invalidate(event.key)
+    return listener
@@ -0,0 +1,80 @@
+import random
+import threading
+from collections import namedtuple
+
+
+HotKey = namedtuple('HotKey', ['key', 'count', 'bytes', 'error'])
+
+
+class SpaceSaving(object):
+    """Space-Saving top-K sketch. Keeps at most `capacity` counters; a new key takes over the
+    smallest counter, whose count becomes the overestimation error of the new key."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counters = {}
+
+    def offer(self, key, size=0, weight=1):
+        counter = self.counters.get(key)
+        if counter is None:
+            if len(self.counters) < self.capacity:
+                counter = [0, 0, 0]
+            else:
+                # The capacity is small, a linear scan is cheaper than maintaining a heap.
+                victim = min(self.counters, key=lambda k: self.counters[k][0])
+                count = self.counters.pop(victim)[0]
+                counter = [count, 0, count]
+            self.counters[key] = counter
+        counter[0] += weight
+        counter[1] += size
+        return counter
+
+    def guaranteed(self, key):
+        counter = self.counters.get(key)
+        return counter[0] - counter[2] if counter else 0
+
+    def top(self, n=None):
+        keys = sorted(self.counters, key=lambda k: self.counters[k][0], reverse=True)
+        return [HotKey(k, *self.counters[k]) for k in keys[:n]]
+
+
+class HotKeySampler(object):
+    """Samples key accesses per operation into fixed size sketches.
+
+    A key is hot for an operation once its guaranteed sampled count reaches `hot_count`.
+    """
+
+    def __init__(self, capacity=64, rate=1.0, hot_count=None, random=random.random):
+        self.capacity = capacity
+        self.rate = rate
+        self.hot_count = hot_count
+        self.random = random
+        self.sketches = {}
+        self.lock = threading.Lock()
+
+    def record(self, op, key, size=0):
+        # size may be a callable, it is measured only when the access is sampled.
+        if self.rate < 1.0 and self.random() >= self.rate:
+            return
+        if callable(size):
+            size = size()
+        with self.lock:
+            sketch = self.sketches.get(op)
+            if sketch is None:
+                sketch = self.sketches[op] = SpaceSaving(self.capacity)
+            sketch.offer(key, size)
+
+    def is_hot(self, op, key):
+        if self.hot_count is None:
+            return False
+        with self.lock:
+            sketch = self.sketches.get(op)
+            return sketch is not None and sketch.guaranteed(key) >= self.hot_count
+
+    def snapshot(self, n=None):
+        with self.lock:
+            return {op: sketch.top(n) for op, sketch in self.sketches.items()}
+
+    def reset(self):
+        with self.lock:
+            self.sketches = {}
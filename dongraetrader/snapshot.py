@@ -0,0 +1,164 @@
+import mmap
+import os
+import struct
+import threading
+import time
+
+from .serializer import StrSerializer
+
+
+MAGIC = b'DTNC\x02'
+# magic, record count, save time
+HEADER = struct.Struct(str('>5sId'))
+# key size, value size, xt, time the value was read from the server
+RECORD = struct.Struct(str('>IIqd'))
+NO_XT = -1
+
+
+def write_snapshot(path, records, key_serializer=None, value_serializer=None, raw_records=(), clock=time.time):
+    # records are (key, value, xt[, read time]). raw_records are already serialized (key, value, xt, read time)
+    # records, like the unread ones of a loaded snapshot; a key that is also in records is skipped.
+    key_serializer = key_serializer or StrSerializer()
+    value_serializer = value_serializer or StrSerializer()
+    now = clock()
+    # Write aside and rename, a process mapping the previous snapshot keeps reading it.
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    written = set()
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, 0, now))
+
+            def write(k, v, xt, at):
+                f.write(RECORD.pack(len(k), len(v), NO_XT if xt is None else xt, at))
+                f.write(k)
+                f.write(v)
+                written.add(k)
+            for record in records:
+                key, value, xt = record[:3]
+                write(key_serializer.serialize(key), value_serializer.serialize(value), xt, record[3] if len(record) > 3 else now)
+            for k, v, xt, at in raw_records:
+                if k not in written:
+                    write(k, v, xt, at)
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, len(written), now))
+        getattr(os, "replace", os.rename)(tmp_path, path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return len(written)
+
+
+class MappedSnapshot(object):
+    """Read-only view of a snapshot file. Records whose xt has passed, or that were read from the
+    server more than `max_age` seconds ago, are dropped."""
+
+    def __init__(self, path, key_serializer=None, value_serializer=None, clock=time.time, max_age=None):
+        self.key_serializer = key_serializer or StrSerializer()
+        self.value_serializer = value_serializer or StrSerializer()
+        self.clock = clock
+        self.max_age = max_age
+        self.saved_at = None
+        self.map = None
+        self.index = {}
+        self.lock = threading.Lock()
+        try:
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size >= HEADER.size:
+                    self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError):
+            return
+        if self.map is not None:
+            self._scan()
+
+    def _scan(self):
+        # Only record headers and keys are read here; values stay in the page cache until they are asked for.
+        # A broken snapshot is dropped as a whole, the cache starts cold.
+        try:
+            magic, count, self.saved_at = HEADER.unpack_from(self.map)
+        except struct.error:
+            magic = None
+        if magic != MAGIC:
+            self.close()
+            return
+        now = self.clock()
+        pos = HEADER.size
+        size = len(self.map)
+        try:
+            for _ in range(count):
+                ksiz, vsiz, xt, at = RECORD.unpack_from(self.map, pos)
+                pos += RECORD.size
+                if pos + ksiz + vsiz > size:
+                    raise ValueError("truncated")
+                xt = None if xt == NO_XT else xt
+                if self._alive(xt, at, now):
+                    self.index[self.map[pos:pos + ksiz]] = (pos + ksiz, vsiz, xt, at)
+                pos += ksiz + vsiz
+        except (struct.error, ValueError):
+            self.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    def _alive(self, xt, at, now):
+        return (xt is None or xt > now) and (self.max_age is None or at + self.max_age > now)
+
+    def pop(self, key):
+        # Returns (value, xt, read time) and forgets the record.
+        with self.lock:
+            entry = self.index.pop(self.key_serializer.serialize(key), None)
+            if entry is None:
+                return None
+            pos, vsiz, xt, at = entry
+            if not self._alive(xt, at, self.clock()):
+                return None
+            return self.value_serializer.deserialize(self.map[pos:pos + vsiz]), xt, at
+
+    def raw_records(self):
+        # Serialized (key, value, xt, read time) of the records not taken yet, to carry them over to a new snapshot.
+        with self.lock:
+            now = self.clock()
+            return [(k, self.map[pos:pos + vsiz], xt, at) for k, (pos, vsiz, xt, at) in self.index.items()
+                    if self._alive(xt, at, now)]
+
+    def discard(self, key):
+        with self.lock:
+            self.index.pop(self.key_serializer.serialize(key), None)
+
+    def close(self):
+        with self.lock:
+            self.index = {}
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+
+
+class PeriodicSnapshot(object):
+    def __init__(self, cache, path, interval=60, key_serializer=None, value_serializer=None):
+        self.cache = cache
+        self.path = path
+        self.interval = interval
+        self.key_serializer = key_serializer
+        self.value_serializer = value_serializer
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def save(self):
+        return self.cache.save(self.path, self.key_serializer, self.value_serializer)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="%s(%s)" % (self.__class__.__name__, self.path))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.save()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.save()
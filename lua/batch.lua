@@ -0,0 +1,46 @@
+-- Dispatcher for KyotoTycoonConnection.play_script_batch.
+--
+-- The input map carries "<i>" = procedure name and "<i>.<key>" = records of the i-th call.
+-- Each procedure is called with its own records and its outputs are returned as "<i>.<key>".
+-- The calls run in order and the batch stops at the first procedure that does not succeed.
+
+function batch(inmap, outmap)
+   local names = {}
+   local args = {}
+   local count = 0
+   for k, v in pairs(inmap) do
+      local i, key = string.match(k, "^(%d+)%.(.*)$")
+      if i then
+         if not args[i] then
+            args[i] = {}
+         end
+         args[i][key] = v
+      elseif string.match(k, "^%d+$") then
+         names[k] = v
+         count = count + 1
+      end
+   end
+   -- pairs() has no defined order, run the calls in the order they were given.
+   for n = 0, count - 1 do
+      local i = tostring(n)
+      local name = names[i]
+      if not name then
+         kt.log("error", "no procedure for call " .. i)
+         return kt.RVEINVALID
+      end
+      local proc = _G[name]
+      if type(proc) ~= "function" then
+         kt.log("error", "no such procedure: " .. name)
+         return kt.RVENOIMPL
+      end
+      local out = {}
+      local rv = proc(args[i] or {}, out)
+      if rv ~= kt.RVSUCCESS then
+         return rv
+      end
+      for k, v in pairs(out) do
+         outmap[i .. "." .. k] = v
+      end
+   end
+   return kt.RVSUCCESS
+end
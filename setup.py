@@ -5,6 +5,10 @@ Dongrae Trader
 
 from setuptools import setup
 
+install_requires = [
+    'selectors34; python_version < "3.4"'
+]
+
 tests_require = [
     'pytest >= 2.5.0'
 ]
@@ -22,6 +26,7 @@ config = {
     'author': 'Park Eungju',
     'author_email': 'eungju@gmail.com',
     'packages': ['dongraetrader'],
+    'install_requires': install_requires,
     'tests_require': tests_require,
     'extras_require': extras_require
 }
@@ -0,0 +1,26 @@
+-- Procedures used by the test suite. Run ktserver with -scr /path/to/tests/kyoto.lua.
+
+-- The daemonized server runs in /, resolve the dispatcher relative to this script.
+local here = string.match(debug.getinfo(1, "S").source, "^@(.*/)") or "./"
+dofile(here .. "../lua/batch.lua")
+
+function echo(inmap, outmap)
+   for k, v in pairs(inmap) do
+      outmap[k] = v
+   end
+   return kt.RVSUCCESS
+end
+
+function incr(inmap, outmap)
+   local key = inmap.key
+   local num = tonumber(inmap.num)
+   if not key or not num then
+      return kt.RVEINVALID
+   end
+   local value = tonumber(kt.db:get(key) or "0") + num
+   if not kt.db:set(key, value) then
+      return kt.RVEINTERNAL
+   end
+   outmap.num = value
+   return kt.RVSUCCESS
+end
@@ -0,0 +1,51 @@
+from dongraetrader.cache import NearCache
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_get_and_invalidate():
+    dut = NearCache(clock=Clock())
+    assert dut.get("k") is None
+    dut.put("k", "v", 200)
+    assert dut.get("k") == ("v", 200)
+    dut.invalidate("k")
+    assert dut.get("k") is None
+
+
+def test_expire_by_ttl_or_xt():
+    clock = Clock()
+    dut = NearCache(ttl=10, clock=clock)
+    dut.put("k", "v")
+    dut.put("l", "w", 105)
+    clock.now = 105
+    assert dut.get("k") == ("v", None)
+    assert dut.get("l") is None
+    clock.now = 110
+    assert dut.get("k") is None
+
+
+def test_evict_least_recently_used():
+    dut = NearCache(capacity=2)
+    dut.put("k", "v")
+    dut.put("l", "w")
+    dut.get("k")
+    dut.put("m", "x")
+    assert dut.get("l") is None
+    assert dut.get("k") == ("v", None)
+    assert len(dut) == 2
+
+
+def test_put_since_skips_after_invalidation():
+    dut = NearCache()
+    since = dut.invalidations
+    dut.invalidate("l")
+    assert not dut.put("k", "v", since=since)
+    assert dut.get("k") is None
+    assert dut.put("k", "v", since=dut.invalidations)
+    assert dut.get("k") == ("v", None)
@@ -0,0 +1,98 @@
+import io
+import threading
+import unittest
+
+from dongraetrader.chunked import ChunkedStore
+from dongraetrader.kyoto import KyotoError, LogicalInconsistencyError
+
+
+class DictClient(object):
+    def __init__(self):
+        self.records = {}
+        self.lock = threading.Lock()
+
+    def set(self, key, value, xt=None):
+        with self.lock:
+            self.records[key] = value
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.records:
+                raise LogicalInconsistencyError("no record was found")
+            return self.records[key], None
+
+    def remove_bulk(self, keys, atomic=None):
+        with self.lock:
+            return len([self.records.pop(key) for key in keys if key in self.records])
+
+
+class ChunkedStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.client = DictClient()
+        self.dut = ChunkedStore(self.client, chunk_size=4, workers=2)
+
+    def tearDown(self):
+        self.dut.close()
+
+    def test_put_and_get_bytes(self):
+        self.assertEqual(self.dut.put("k", b'0123456789'), 10)
+        self.assertEqual(len(self.client.records), 4)
+        self.assertEqual(self.dut.manifest("k")[:3], (10, 4, 3))
+        self.assertEqual(self.dut.get("k"), b'0123456789')
+
+    def test_stream_from_and_to_file(self):
+        self.dut.put("k", io.BytesIO(b'01234567'))
+        out = io.BytesIO()
+        self.assertEqual(self.dut.get("k", out), 8)
+        self.assertEqual(out.getvalue(), b'01234567')
+        self.assertTrue(all(len(v) <= 4 for k, v in self.client.records.items() if k != "k"))
+
+    def test_empty_value(self):
+        self.dut.put("k", b'')
+        self.assertEqual(self.dut.get("k"), b'')
+
+    def test_overwrite_removes_old_chunks(self):
+        self.dut.put("k", b'0123456789')
+        self.dut.put("k", b'abc')
+        self.assertEqual(len(self.client.records), 2)
+        self.assertEqual(self.dut.get("k"), b'abc')
+
+    def test_remove(self):
+        self.dut.put("k", b'0123456789')
+        self.assertTrue(self.dut.remove("k"))
+        self.assertEqual(self.client.records, {})
+        self.assertFalse(self.dut.remove("k"))
+        self.assertRaises(LogicalInconsistencyError, self.dut.get, "k")
+
+    def test_not_chunked_value(self):
+        self.client.set("k", b'plain')
+        self.assertRaises(KyotoError, self.dut.get, "k")
+        self.assertRaises(KyotoError, self.dut.put, "k", b'0123')
+        self.assertRaises(KyotoError, self.dut.remove, "k")
+        self.assertEqual(self.client.records, {"k": b'plain'})
+
+    def test_server_error_keeps_old_chunks_referenced(self):
+        self.dut.put("k", b'0123456789')
+        get = self.client.get
+
+        def fail(key):
+            raise KyotoError("temporary failure")
+        self.client.get = fail
+        self.assertRaises(KyotoError, self.dut.put, "k", b'abc')
+        self.client.get = get
+        self.assertEqual(len(self.client.records), 4)
+        self.assertEqual(self.dut.get("k"), b'0123456789')
+
+    def test_get_detects_missing_chunk(self):
+        self.dut.put("k", b'0123456789')
+        del self.client.records["k\x00%016x\x001" % self.dut.manifest("k")[3]]
+        self.assertRaises(KyotoError, self.dut.get, "k")
+
+    def test_failed_put_removes_written_chunks(self):
+        def fail(key, value, xt=None):
+            if key == "k":
+                raise KyotoError("failed")
+            DictClient.set(self.client, key, value, xt)
+        self.client.set = fail
+        self.assertRaises(KyotoError, self.dut.put, "k", b'0123456789')
+        self.assertEqual(self.client.records, {})
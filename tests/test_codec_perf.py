@@ -0,0 +1,25 @@
+from benchmarks import codec
+
+
+def test_cases_cover_codec_hot_path():
+    names = [name for name, func, args in codec.cases(quick=True)]
+    for prefix in ("tsvrpc.write.url", "tsvrpc.read.b64", "url.decode", "b64.encode", "assoc_get", "text.deserialize"):
+        assert any(name.startswith(prefix) for name in names)
+    assert len(names) == len(set(names))
+
+
+def test_run_measures_ops_and_allocations():
+    results = codec.run(quick=True, pattern="assoc_find", min_time=0.001)
+    assert sorted(results) == ["assoc_find[columns=1]", "assoc_find[columns=8]"]
+    assert all(result["ops"] > 0 for result in results.values())
+
+
+def test_compare_reports_regressions():
+    baseline = {"a": {"ops": 100.0, "peak_bytes": 1000}, "b": {"ops": 100.0, "peak_bytes": None}}
+    results = {"a": {"ops": 70.0, "peak_bytes": 2000}, "b": {"ops": 90.0, "peak_bytes": 10}, "c": {"ops": 1.0, "peak_bytes": 1}}
+    assert codec.compare(results, baseline, tolerance=0.25) == [("a", "ops", 100.0, 70.0), ("a", "peak_bytes", 1000, 2000)]
+
+
+def test_stored_baseline_covers_every_case():
+    baseline = codec.load_baseline(codec.DEFAULT_BASELINE)
+    assert set(baseline) == set(name for name, func, args in codec.cases())
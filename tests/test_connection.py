@@ -1,3 +1,5 @@
+import os
+import time
 import unittest
 
 from dongraetrader import connection
@@ -56,3 +58,43 @@ class ConnectionPoolTest(unittest.TestCase):
         except DummyException:
             self.assertTrue(acquired.closed)
             self.assertTrue(acquired not in self.dut.pool.queue)
+
+
+@unittest.skipUnless(hasattr(os, "register_at_fork"), "os.register_at_fork is not available")
+class ConnectionPoolForkTest(unittest.TestCase):
+    def fork(self, child):
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(r)
+            try:
+                result = child()
+            except Exception as e:
+                result = repr(e)
+            os.write(w, repr(result).encode("ascii"))
+            os._exit(0)
+        os.close(w)
+        with os.fdopen(r) as f:
+            result = f.read()
+        os.waitpid(pid, 0)
+        return result
+
+    def test_child_discards_inherited_connections_and_warms_up(self):
+        dut = connection.ConnectionPool({"min": 2}, DummyConnection)
+        with dut.connection() as c:
+            inherited = c
+
+        def child():
+            for i in range(100):
+                if len(dut.pool.queue) == 2:
+                    break
+                time.sleep(0.01)
+            return (dut.pid == os.getpid(), inherited.closed, inherited in dut.pool.queue,
+                    [isinstance(c, DummyConnection) for c in dut.pool.queue])
+        self.assertEqual(self.fork(child), repr((True, True, False, [True, True])))
+        self.assertFalse(inherited.closed)
+        self.assertTrue(inherited in dut.pool.queue)
+
+    def test_child_without_warm_up(self):
+        dut = connection.ConnectionPool({"min": 2, "warm_after_fork": False}, DummyConnection)
+        self.assertEqual(self.fork(lambda: list(dut.pool.queue)), repr([None, None]))
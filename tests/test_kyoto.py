@@ -4,6 +4,9 @@ import time
 import unittest
 
 from dongraetrader import kyoto
+from dongraetrader.cache import NearCache
+from dongraetrader.connection import Connection, ConnectionPool
+from dongraetrader.sampler import HotKeySampler
 
 
 class AssocTest(unittest.TestCase):
@@ -73,6 +76,170 @@ class TsvRpcTest(unittest.TestCase):
         self.assertEquals(self.dut.read(b'a\n', self.column_encoding), [(b'a',)])
         self.assertEquals(self.dut.write([(b'a', )], self.column_encoding), b'a\n')
 
+    def test_scan(self):
+        self.assertEqual(list(self.dut.scan(b'')), [])
+        self.assertEqual(list(self.dut.scan(b'a\tb\nc\n\nd\te')), [(0, 1, 3), (4, -1, 5), (7, 8, 10)])
+
+
+class LazyRecordsTest(unittest.TestCase):
+    def setUp(self):
+        self.dut = kyoto.LazyRecords(b'_k\tv\n_%20\t%09\nnum\t2\n', kyoto.URLColumnEncoding(), b'_',
+                                     kyoto.StrSerializer(), kyoto.StrSerializer())
+
+    def test_index_only_prefixed_keys(self):
+        self.assertEqual(len(self.dut), 2)
+        self.assertEqual(sorted(self.dut), [' ', 'k'])
+        self.assertTrue('k' in self.dut)
+        self.assertFalse('num' in self.dut)
+
+    def test_decode_on_access(self):
+        self.assertEqual(self.dut['k'], 'v')
+        self.assertEqual(self.dut[' '], '\t')
+        self.assertRaises(KeyError, self.dut.__getitem__, 'l')
+        self.assertEqual(self.dut, {'k': 'v', ' ': '\t'})
+
+
+class LazyKeysTest(unittest.TestCase):
+    def setUp(self):
+        self.dut = kyoto.LazyKeys(b'_k\t0\n_%20k\t1\nnum\t2', kyoto.URLColumnEncoding(), b'_', kyoto.StrSerializer())
+
+    def test_decode_on_access(self):
+        self.assertEqual(len(self.dut), 2)
+        self.assertEqual(self.dut[0], 'k')
+        self.assertEqual(self.dut[-1], ' k')
+        self.assertEqual(self.dut[:1], ['k'])
+        self.assertEqual(list(self.dut), ['k', ' k'])
+
+    def test_base64_keys(self):
+        dut = kyoto.LazyKeys(b'X2s=\tMA==\nbnVt\tMQ==\n', kyoto.Base64ColumnEncoding(), b'_', kyoto.StrSerializer())
+        self.assertEqual(list(dut), ['k'])
+
+
+class DictConnection(Connection):
+    def __init__(self, records, calls):
+        super(DictConnection, self).__init__([])
+        self.records = records
+        self.calls = calls
+
+    def close(self):
+        pass
+
+    def clear(self, db=None):
+        self.records.clear()
+
+    def set(self, key, value, xt=None, db=None):
+        self.records[key] = value
+
+    def increment(self, key, num, orig=None, xt=None, db=None):
+        num += int(self.records.get(key, "0"))
+        self.records[key] = str(num)
+        return num
+
+    def get(self, key, db=None):
+        self.calls.append(key)
+        if key not in self.records:
+            raise kyoto.LogicalInconsistencyError("DB: 7: no record: no record")
+        return self.records[key], None
+
+    def remove_bulk(self, keys, atomic=None, db=None):
+        return len([self.records.pop(key) for key in keys if key in self.records])
+
+    def get_bulk(self, keys, atomic=None, db=None, lazy=False):
+        return dict((key, self.records[key]) for key in keys if key in self.records)
+
+    def play_script(self, name, records):
+        self.records.update(records)
+        return {}
+
+
+class KyotoTycoonClientTest(unittest.TestCase):
+    def setUp(self):
+        self.records = {}
+        self.calls = []
+        self.sampler = HotKeySampler(hot_count=2)
+        self.near_cache = NearCache()
+        self.dut = kyoto.KyotoTycoonClient("localhost", 1978, sampler=self.sampler, near_cache=self.near_cache)
+        self.dut.pool = ConnectionPool({}, DictConnection, records=self.records, calls=self.calls)
+
+    def test_sample_serialized_sizes(self):
+        self.dut.set("k", "\uac00")
+        self.dut.get("k")
+        self.dut.increment("n", 1)
+        self.dut.get_bulk(["k", "l"])
+        self.dut.remove_bulk(["k"])
+        snapshot = self.dut.hot_keys()
+        self.assertEqual(snapshot["set"], [("k", 1, 3, 0)])
+        self.assertEqual(snapshot["get"], [("k", 1, 3, 0)])
+        self.assertEqual(snapshot["increment"], [("n", 1, 0, 0)])
+        self.assertEqual(sorted(snapshot["get_bulk"]), [("k", 1, 3, 0), ("l", 1, 0, 0)])
+        self.assertEqual(snapshot["remove_bulk"], [("k", 1, 0, 0)])
+
+    def test_pin_hot_keys(self):
+        self.dut.set("k", "v")
+        self.dut.get("k")
+        self.assertEqual(len(self.near_cache), 0)
+        self.dut.get("k")
+        self.assertEqual(self.near_cache.get("k"), ("v", None))
+        self.assertEqual(self.dut.get("k"), ("v", None))
+        self.assertEqual(self.calls, ["k", "k"])
+
+    def pin(self, key):
+        self.dut.get(key)
+        self.dut.get(key)
+        self.assertIsNotNone(self.near_cache.get(key))
+
+    def test_writes_invalidate_pinned_keys(self):
+        self.records.update({"k": "v", "l": "w", "n": "1"})
+        self.pin("k")
+        self.dut.set("k", "x")
+        self.assertEqual(self.dut.get("k"), ("x", None))
+        self.pin("n")
+        self.dut.increment("n", 1)
+        self.assertEqual(self.dut.get("n"), ("2", None))
+        self.pin("l")
+        self.dut.remove_bulk(["l"])
+        self.assertRaises(kyoto.LogicalInconsistencyError, self.dut.get, "l")
+
+    def test_bulk_calls_accept_generators(self):
+        self.records.update({"k": "v", "l": "w"})
+        self.pin("k")
+        self.assertEqual(self.dut.get_bulk(key for key in ["k", "l"]), {"k": "v", "l": "w"})
+        self.assertEqual(len(self.sampler.snapshot()["get_bulk"]), 2)
+        self.assertEqual(self.dut.remove_bulk(key for key in ["k"]), 1)
+        self.assertIsNone(self.near_cache.get("k"))
+        self.assertRaises(kyoto.LogicalInconsistencyError, self.dut.get, "k")
+
+    def test_script_call_empties_near_cache(self):
+        self.records["k"] = "v"
+        self.pin("k")
+        self.dut.play_script("set", {"k": "w"})
+        self.assertEqual(self.dut.get("k"), ("w", None))
+
+    def test_clear_empties_near_cache(self):
+        self.records["k"] = "v"
+        self.pin("k")
+        self.dut.clear()
+        self.assertEqual(len(self.near_cache), 0)
+        self.assertRaises(kyoto.LogicalInconsistencyError, self.dut.get, "k")
+
+    def test_do_not_pin_value_read_before_concurrent_write(self):
+        self.records["k"] = "v"
+        self.dut.get("k")
+        get = DictConnection.get
+
+        def get_racing_with_set(conn, key, db=None):
+            value = get(conn, key, db)
+            self.records[key] = "w"
+            self.near_cache.invalidate(key)
+            return value
+        DictConnection.get = get_racing_with_set
+        try:
+            self.assertEqual(self.dut.get("k"), ("v", None))
+        finally:
+            DictConnection.get = get
+        self.assertIsNone(self.near_cache.get("k"))
+        self.assertEqual(self.dut.get("k"), ("w", None))
+
 
 class KyotoTycoonConnectionTest(unittest.TestCase):
     def setUp(self):
@@ -183,6 +350,14 @@ class KyotoTycoonConnectionTest(unittest.TestCase):
         self.dut.set("l", "w")
         self.assertEqual(self.dut.get_bulk(["k", "l"]), {"k": "v", "l": "w"})
 
+    def test_get_bulk_lazy(self):
+        self.dut.set("k", "v")
+        self.dut.set("l", "w")
+        actual = self.dut.get_bulk(["k", "l", "m"], lazy=True)
+        self.assertEqual(len(actual), 2)
+        self.assertEqual(actual["l"], "w")
+        self.assertEqual(dict(actual), {"k": "v", "l": "w"})
+
     def test_get_bulk_with_atomic(self):
         self.assertEqual(self.dut.get_bulk(["k", "l"], atomic=True), {})
 
@@ -193,8 +368,28 @@ class KyotoTycoonConnectionTest(unittest.TestCase):
         self.dut.set("l", "w")
         self.assertEqual(self.dut.match_prefix("k"), ["k", "kk"])
 
+    def test_match_prefix_lazy(self):
+        self.dut.set("k", "v")
+        self.dut.set("kk", "vv")
+        self.assertEqual(list(self.dut.match_prefix("k", lazy=True)), ["k", "kk"])
+
     def test_match_prefix_with_max(self):
         self.dut.set("k", "v")
         self.dut.set("kk", "vv")
         self.dut.set("l", "w")
         self.assertEqual(self.dut.match_prefix("k", max=1), ["k"])
+
+    def test_play_script(self):
+        self.assertEqual(self.dut.play_script("echo", {"k": "v"}), {"k": "v"})
+
+    def test_play_script_error_no_such_procedure(self):
+        self.assertRaises(kyoto.KyotoError, self.dut.play_script, "not_implemented", {})
+
+    def test_play_script_batch(self):
+        self.assertEqual(self.dut.play_script_batch([("echo", {"k": "v"}), ("incr", {"key": "count", "num": "2"}), ("echo", {})]),
+                         [{"k": "v"}, {"num": "2"}, {}])
+        self.assertEqual(self.dut.get("count"), ("2", None))
+
+    def test_play_script_batch_runs_calls_in_order(self):
+        calls = [("incr", {"key": "count", "num": "2"}) for _ in range(12)]
+        self.assertEqual(self.dut.play_script_batch(calls), [{"num": str(2 * (i + 1))} for i in range(12)])
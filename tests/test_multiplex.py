@@ -0,0 +1,132 @@
+import threading
+import time
+import unittest
+try:
+    from socketserver import ThreadingMixIn
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from SocketServer import ThreadingMixIn
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from dongraetrader import kyoto
+from dongraetrader.multiplex import Multiplexer, DeadlineExceeded
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        encoding = kyoto.URLColumnEncoding()
+        input = kyoto.TsvRpc.read(self.rfile.read(int(self.headers["Content-Length"])), encoding)
+        self.server.connections.add(self.client_address)
+        if self.path == "/rpc/html":
+            body = b'<html>Bad Gateway</html>'
+            self.send_response(502)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.path == "/rpc/sleep":
+            time.sleep(float(kyoto.assoc_get(input, b'seconds')))
+        status, output = 200, input
+        if self.path == "/rpc/get":
+            status, output = 450, [(b'ERROR', b'DB: 7: no record: no record')]
+        body = kyoto.TsvRpc.write(output, encoding)
+        self.send_response(status)
+        self.send_header("Content-Type", kyoto.TsvRpc.content_type_for(encoding))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        # Like ktserver closing an idle session after its timeout, without telling the client.
+        self.close_connection = self.server.close_after_response
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, close_after_response=False):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StandInHandler)
+        self.close_after_response = close_after_response
+        self.connections = set()
+        self.node = self.server_address
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class MultiplexerTest(unittest.TestCase):
+    def setUp(self):
+        self.servers = [StandInServer(), StandInServer()]
+        self.dut = Multiplexer(max_connections=2, timeout=5)
+
+    def tearDown(self):
+        self.dut.close()
+        for server in self.servers:
+            server.stop()
+
+    def test_batch_across_nodes(self):
+        requests = [(server.node, "echo", [(b'k', ('%d' % i).encode('ascii'))]) for i in range(5) for server in self.servers]
+        calls = self.dut.batch(requests)
+        self.assertEqual([call.result() for call in calls], [input for node, name, input in requests])
+        for server in self.servers:
+            self.assertTrue(len(server.connections) <= 2)
+
+    def test_calls_run_concurrently(self):
+        start = time.time()
+        self.dut.batch([(server.node, "sleep", [(b'seconds', b'0.3')]) for server in self.servers for _ in range(2)])
+        self.assertTrue(time.time() - start < 0.55)
+
+    def test_wait_first(self):
+        slow = self.dut.submit(self.servers[0].node, "sleep", [(b'seconds', b'0.5')])
+        fast = self.dut.submit(self.servers[1].node, "void", [])
+        self.assertEqual(self.dut.wait([slow, fast], count=1), [fast])
+        self.assertFalse(slow.done)
+        self.assertEqual(self.dut.wait([slow]), [slow])
+
+    def test_error(self):
+        call = self.dut.submit(self.servers[0].node, "get", [(b'key', b'k')])
+        self.dut.wait([call])
+        self.assertRaises(kyoto.LogicalInconsistencyError, call.result)
+
+    def test_deadline(self):
+        late = self.dut.submit(self.servers[0].node, "sleep", [(b'seconds', b'0.5')], timeout=0.1)
+        self.dut.wait([late])
+        self.assertRaises(DeadlineExceeded, late.result)
+        call = self.dut.submit(self.servers[0].node, "void", [])
+        self.dut.wait([call])
+        self.assertEqual(call.result(), [])
+
+    def test_connection_refused(self):
+        node = self.servers[1].node
+        self.servers[1].stop()
+        call = self.dut.submit(node, "void", [])
+        self.dut.wait([call])
+        self.assertRaises(Exception, call.result)
+
+    def test_non_tsv_response(self):
+        call = self.dut.submit(self.servers[0].node, "html", [])
+        self.assertEqual(self.dut.wait([call]), [call])
+        self.assertRaises(kyoto.KyotoError, call.result)
+        self.assertIsNone(call.channel)
+        call = self.dut.submit(self.servers[0].node, "void", [])
+        self.dut.wait([call])
+        self.assertEqual(call.result(), [])
+
+    def test_server_closed_kept_alive_connection(self):
+        server = StandInServer(close_after_response=True)
+        try:
+            for pause in (0, 0.05, 0, 0.05):
+                call = self.dut.submit(server.node, "void", [])
+                self.dut.wait([call])
+                self.assertEqual(call.result(), [])
+                time.sleep(pause)
+        finally:
+            server.stop()
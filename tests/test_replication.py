@@ -0,0 +1,126 @@
+import socket
+import struct
+import threading
+import unittest
+
+from dongraetrader import replication
+from dongraetrader.cache import NearCache
+from dongraetrader.kyoto import KyotoError
+
+
+def log_entry(ts, op, body=b'', sid=1, db=0):
+    message = struct.pack('>HHB', sid, db, op) + body
+    return struct.pack('>BQI', 0xb1, ts, len(message)) + message
+
+
+def set_entry(ts, key, value, xt=(1 << 40) - 1):
+    return log_entry(ts, 0xa1, struct.pack('>BB', len(key), len(value) + 5) + key + struct.pack('>Q', xt)[3:] + value)
+
+
+def remove_entry(ts, key):
+    return log_entry(ts, 0xa2, struct.pack('>B', len(key)) + key)
+
+
+class StandInServer(object):
+    def __init__(self, messages, accept=True):
+        self.messages = messages
+        self.accept = accept
+        self.handshakes = []
+        self.acks = 0
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def serve(self):
+        conn, _ = self.listener.accept()
+        try:
+            self.handshakes.append(struct.unpack('>BIQH', self._receive(conn, 15)))
+            if not self.accept:
+                conn.sendall(b'\x00')
+                return
+            conn.sendall(b'\xb1')
+            for message in self.messages:
+                conn.sendall(message)
+                if message == b'\xb0':
+                    self.acks += self._receive(conn, 1) == b'\xb1'
+        finally:
+            conn.close()
+            self.listener.close()
+
+    def _receive(self, conn, size):
+        buf = b''
+        while len(buf) < size:
+            buf += conn.recv(size - len(buf))
+        return buf
+
+
+class ReplicationClientTest(unittest.TestCase):
+    def test_read_synthetic_log(self):
+        server = StandInServer([set_entry(10, b'k', b'v'), b'\xb0', set_entry(11, b'l', b'w', xt=1234),
+                                remove_entry(12, b'k'), log_entry(13, 0xa9), log_entry(14, 0xa3)])
+        with replication.ReplicationClient('127.0.0.1', server.port, ts=7, sid=3, timeout=5) as dut:
+            events = [dut.read() for _ in range(4)]
+            self.assertRaises(KyotoError, dut.read)
+        self.assertEqual(server.handshakes, [(0xb1, 0, 7, 3)])
+        self.assertEqual(server.acks, 1)
+        self.assertEqual(events, [
+            replication.ChangeEvent(10, 1, 0, "set", "k", "v", None),
+            replication.ChangeEvent(11, 1, 0, "set", "l", "w", 1234),
+            replication.ChangeEvent(12, 1, 0, "remove", "k", None, None),
+            replication.ChangeEvent(14, 1, 0, "clear", None, None, None),
+        ])
+        self.assertEqual(dut.ts, 14)
+
+    def test_malformed_entry(self):
+        server = StandInServer([log_entry(10, 0xa1, b'\x85')])
+        with replication.ReplicationClient('127.0.0.1', server.port, timeout=5) as dut:
+            self.assertRaises(KyotoError, dut.read)
+
+    def test_refused(self):
+        server = StandInServer([], accept=False)
+        dut = replication.ReplicationClient('127.0.0.1', server.port, timeout=5)
+        self.assertRaises(KyotoError, dut.open)
+
+    def test_read_varnum(self):
+        self.assertEqual(replication.read_varnum(bytearray(b'\x05'), 0), (5, 1))
+        self.assertEqual(replication.read_varnum(bytearray(b'\x00\x81\x00'), 1), (128, 3))
+
+
+class ChangeFeedTest(unittest.TestCase):
+    def test_survive_listener_error(self):
+        server = StandInServer([remove_entry(10, b'k'), remove_entry(11, b'l')])
+        received = []
+        done = threading.Event()
+
+        def listener(event):
+            received.append(event.key)
+            if event.key == "k":
+                raise ValueError("listener failed")
+            done.set()
+        dut = replication.ChangeFeed(listener, '127.0.0.1', server.port, timeout=5, retry_interval=0.01)
+        dut.start()
+        self.assertTrue(done.wait(5))
+        dut.stop()
+        self.assertEqual(received, ["k", "l"])
+
+    def test_invalidate_cache(self):
+        cache = NearCache()
+        cache.put("k", "v")
+        cache.put("l", "w")
+        server = StandInServer([set_entry(10, b'k', b'x')])
+        received = threading.Event()
+        invalidate = replication.invalidator(cache)
+
+        def listener(event):
+            invalidate(event)
+            received.set()
+        dut = replication.ChangeFeed(listener, '127.0.0.1', server.port, timeout=5, retry_interval=0.01)
+        dut.start()
+        self.assertTrue(received.wait(5))
+        dut.stop()
+        self.assertIsNone(cache.get("k"))
+        self.assertEqual(cache.get("l"), ("w", None))
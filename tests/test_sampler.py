@@ -0,0 +1,46 @@
+from dongraetrader.sampler import SpaceSaving, HotKeySampler
+
+
+def test_space_saving_counts_exactly_within_capacity():
+    dut = SpaceSaving(3)
+    for key in "abacab":
+        dut.offer(key, size=2)
+    assert [(h.key, h.count, h.bytes, h.error) for h in dut.top()] == [("a", 3, 6, 0), ("b", 2, 4, 0), ("c", 1, 2, 0)]
+
+
+def test_space_saving_replaces_smallest_counter():
+    dut = SpaceSaving(2)
+    for key in "aaabc":
+        dut.offer(key)
+    assert [(h.key, h.count, h.error) for h in dut.top()] == [("a", 3, 0), ("c", 2, 1)]
+    assert dut.guaranteed("c") == 1
+    assert dut.guaranteed("b") == 0
+
+
+def test_sampler_tracks_operations_separately():
+    dut = HotKeySampler(capacity=8)
+    dut.record("get", "k", 3)
+    dut.record("get", "k", 3)
+    dut.record("set", "l", 1)
+    snapshot = dut.snapshot()
+    assert [(h.key, h.count, h.bytes) for h in snapshot["get"]] == [("k", 2, 6)]
+    assert [(h.key, h.count, h.bytes) for h in snapshot["set"]] == [("l", 1, 1)]
+
+
+def test_sampler_rate():
+    samples = iter([0.5, 0.05])
+    dut = HotKeySampler(rate=0.1, random=lambda: next(samples))
+    dut.record("get", "k")
+    dut.record("get", "l")
+    assert [h.key for h in dut.snapshot()["get"]] == ["l"]
+
+
+def test_sampler_hot_key():
+    dut = HotKeySampler(hot_count=2)
+    dut.record("get", "k")
+    assert not dut.is_hot("get", "k")
+    dut.record("get", "k")
+    assert dut.is_hot("get", "k")
+    assert not dut.is_hot("set", "k")
+    dut.reset()
+    assert dut.snapshot() == {}
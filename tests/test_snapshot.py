@@ -0,0 +1,151 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from dongraetrader.cache import NearCache
+from dongraetrader.serializer import BytesSerializer
+from dongraetrader.snapshot import MappedSnapshot, PeriodicSnapshot, write_snapshot
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "cache.snapshot")
+        self.clock = Clock()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write_and_map(self):
+        self.assertEqual(write_snapshot(self.path, [("k", "v", None), ("l", "w", 200), ("m", "x", 100)], clock=self.clock), 3)
+        dut = MappedSnapshot(self.path, clock=self.clock)
+        self.assertEqual(len(dut), 2)
+        self.assertEqual(dut.saved_at, 100.0)
+        self.assertEqual(dut.pop("k"), ("v", None, 100.0))
+        self.assertIsNone(dut.pop("k"))
+        self.assertIsNone(dut.pop("m"))
+        self.clock.now = 200
+        self.assertIsNone(dut.pop("l"))
+        dut.close()
+
+    def test_serializers(self):
+        write_snapshot(self.path, [(b'k', b'\x00\xff', None, 50.0)], BytesSerializer(), BytesSerializer())
+        dut = MappedSnapshot(self.path, BytesSerializer(), BytesSerializer())
+        self.assertEqual(dut.pop(b'k'), (b'\x00\xff', None, 50.0))
+        dut.close()
+
+    def test_max_age(self):
+        write_snapshot(self.path, [("k", "v", None, 40.0), ("l", "w", None, 60.0), ("m", "x", None, 90.0)])
+        dut = MappedSnapshot(self.path, clock=self.clock, max_age=50)
+        self.assertEqual(len(dut), 2)
+        self.clock.now = 115
+        self.assertIsNone(dut.pop("l"))
+        self.assertEqual(dut.pop("m"), ("x", None, 90.0))
+        dut.close()
+
+    def test_missing_or_broken_file(self):
+        self.assertEqual(len(MappedSnapshot(self.path)), 0)
+        with open(self.path, "wb") as f:
+            f.write(b'garbage garbage')
+        self.assertEqual(len(MappedSnapshot(self.path)), 0)
+
+    def test_truncated_file(self):
+        write_snapshot(self.path, [("k", "v", None), ("l", "w", None)])
+        with open(self.path, "rb") as f:
+            data = f.read()
+        for end in (len(data) - 1, len(data) - 6, 12):
+            with open(self.path, "wb") as f:
+                f.write(data[:end])
+            cache = NearCache()
+            self.assertEqual(cache.load(self.path), 0)
+            self.assertIsNone(cache.get("k"))
+
+    def test_failed_write_leaves_no_file(self):
+        def records():
+            yield "k", "v", None
+            raise ValueError("serialization failed")
+        self.assertRaises(ValueError, write_snapshot, self.path, records())
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_warm_start_near_cache(self):
+        cache = NearCache(clock=self.clock)
+        cache.put("k", "v")
+        cache.put("l", "w", 150)
+        cache.save(self.path)
+
+        dut = NearCache(clock=self.clock)
+        self.assertEqual(dut.load(self.path), 2)
+        self.assertEqual(len(dut), 0)
+        self.assertEqual(dut.get("k"), ("v", None))
+        self.assertEqual(len(dut), 1)
+        dut.invalidate("l")
+        self.assertIsNone(dut.get("l"))
+        dut.unload()
+
+    def test_save_carries_over_records_not_taken_yet(self):
+        cache = NearCache(capacity=1000, clock=self.clock)
+        for i in range(100):
+            cache.put("k%d" % i, "v%d" % i)
+        cache.save(self.path)
+
+        self.clock.now = 200
+        dut = NearCache(clock=self.clock)
+        dut.load(self.path)
+        self.assertEqual(dut.get("k0"), ("v0", None))
+        dut.invalidate("k1")
+        dut.put("k2", "w")
+        self.assertEqual(dut.save(self.path), 99)
+        dut.unload()
+
+        snapshot = MappedSnapshot(self.path, clock=self.clock)
+        self.assertEqual(len(snapshot), 99)
+        self.assertEqual(snapshot.pop("k2"), ("w", None, 200.0))
+        # The read time of a carried over record is kept, saving again does not make it younger.
+        self.assertEqual(snapshot.pop("k0"), ("v0", None, 100.0))
+        self.assertEqual(snapshot.pop("k3"), ("v3", None, 100.0))
+        self.assertIsNone(snapshot.pop("k1"))
+        snapshot.close()
+
+    def test_near_cache_expires_old_snapshot_records(self):
+        cache = NearCache(clock=self.clock)
+        cache.put("k", "v")
+        cache.save(self.path)
+        self.clock.now = 100 + 3600
+        dut = NearCache(clock=self.clock)
+        self.assertEqual(dut.load(self.path), 0)
+        self.assertEqual(dut.load(self.path, max_age=None), 1)
+        dut.unload()
+
+    def test_invalidation_racing_with_snapshot_take(self):
+        cache = NearCache(clock=self.clock)
+        cache.put("k", "v")
+        cache.save(self.path)
+        dut = NearCache(clock=self.clock)
+        dut.load(self.path)
+        pop = dut.snapshot.pop
+
+        def pop_racing_with_invalidate(key):
+            found = pop(key)
+            dut.invalidate(key)
+            return found
+        dut.snapshot.pop = pop_racing_with_invalidate
+        self.assertIsNone(dut.get("k"))
+        self.assertEqual(len(dut), 0)
+        dut.unload()
+
+    def test_periodic_snapshot_saves_on_stop(self):
+        cache = NearCache(clock=self.clock)
+        cache.put("k", "v")
+        dut = PeriodicSnapshot(cache, self.path, interval=60)
+        dut.start()
+        dut.stop()
+        self.assertEqual(MappedSnapshot(self.path, clock=self.clock).pop("k"), ("v", None, 100.0))